@@ -1,5 +1,9 @@
+import copy
 import os
+import re
 import sqlite3
+from itertools import groupby
+from operator import itemgetter
 from dotenv import load_dotenv
 from pyzotero import zotero
 
@@ -7,6 +11,21 @@ from pyzotero import zotero
 DB_NAME = "kindle_highlights.sqlite"
 HIGHLIGHTS_TABLE_NAME = "highlights_notes"
 ZOTERO_COLLECTION_NAME = "Kindle Highlights"
+ZOTERO_BATCH_SIZE = 50 # Maximum number of items the Zotero API accepts per create_items request
+EXTRA_ASIN_RE = re.compile(r"^ASIN: (\S+)", re.MULTILINE) # ASIN lines written to a book item's 'extra' field
+
+def open_db(path):
+    """Opens the SQLite database with WAL journaling and read-friendly PRAGMAs applied."""
+    conn = sqlite3.connect(path)
+    conn.executescript("""
+        PRAGMA journal_mode=WAL;
+        PRAGMA synchronous=NORMAL;
+        PRAGMA temp_store=MEMORY;
+        PRAGMA mmap_size=268435456;
+        PRAGMA cache_size=-65536;
+        PRAGMA busy_timeout=5000;
+    """)
+    return conn
 
 def main():
     # Load environment variables from .env file
@@ -28,20 +47,29 @@ def main():
         print(f"Could not find or create collection '{ZOTERO_COLLECTION_NAME}'. Exiting.")
         return
     print(f"Using Zotero collection: '{ZOTERO_COLLECTION_NAME}' (ID: {collection_id})")
+    book_index = index_collection_books(zot, collection_id)
+
+    # Fetch the item templates once; each new book/note starts from a copy of these
+    book_template = zot.item_template('book')
+    note_template = zot.item_template('note')
 
     # 2. Connect to SQLite and fetch data
-    conn = sqlite3.connect(DB_NAME)
+    conn = open_db(DB_NAME)
     cursor = conn.cursor()
 
-    # Get unique books first
-    cursor.execute(f"SELECT DISTINCT book_title, book_author, book_asin FROM {HIGHLIGHTS_TABLE_NAME}")
-    unique_books = cursor.fetchall()
-    print(f"Found {len(unique_books)} unique books in the database.")
+    # Fetch every highlight/note in one ordered scan and group them by book in Python,
+    # instead of querying the table once per unique book. The scraper's idx_book index
+    # lets SQLite read the rows in this order without a sort step.
+    cursor.execute(f"""
+        SELECT book_title, book_author, book_asin, content, item_type, original_id
+        FROM {HIGHLIGHTS_TABLE_NAME}
+        ORDER BY book_title, book_author, book_asin, id
+    """)
 
     processed_books = 0
     processed_notes = 0
 
-    for book_title, book_author, book_asin in unique_books:
+    for (book_title, book_author, book_asin), rows in groupby(cursor, key=itemgetter(0, 1, 2)):
         if not book_title or book_title == "Unknown Title":
             print(f"Skipping book with missing or unknown title (ASIN: {book_asin}).")
             continue
@@ -49,7 +77,7 @@ def main():
         print(f"\nProcessing book: {book_title} by {book_author if book_author else 'Unknown Author'}")
 
         # 2a. Create a Zotero item for the book if one doesn't already exist
-        zotero_book_item = get_or_create_book_item(zot, collection_id, book_title, book_author, book_asin)
+        zotero_book_item = get_or_create_book_item(zot, collection_id, book_index, book_template, book_title, book_author, book_asin)
         if not zotero_book_item:
             print(f"  Could not create or find Zotero item for book: {book_title}. Skipping its highlights.")
             continue
@@ -58,22 +86,24 @@ def main():
         print(f"  Using Zotero book item: {book_title} (Key: {book_item_key})")
         processed_books +=1
 
-        # 2b. Fetch and create Zotero notes for highlights/notes of this book
-        cursor.execute(f"""
-            SELECT content, item_type, original_id 
-            FROM {HIGHLIGHTS_TABLE_NAME} 
-            WHERE book_title = ? AND (book_author = ? OR (? IS NULL AND book_author IS NULL)) AND book_asin = ?
-        """, (book_title, book_author, book_author, book_asin))
-        
-        items_for_book = cursor.fetchall()
-        print(f"  Found {len(items_for_book)} highlights/notes for this book in the database.")
+        # 2b. Create Zotero notes for highlights/notes of this book
+        # Removed duplicate checking logic based on original_id as per user request
+        # All notes/highlights from the DB will be added.
+        # Rows are read lazily from the cursor straight into note templates.
+        note_templates = []
+        note_refs = []
+        for _, _, _, content, item_type, original_id in rows:
+            note_templates.append(build_note_template(note_template, book_item_key, content, item_type))
+            note_refs.append((item_type, original_id))
+        print(f"  Found {len(note_templates)} highlights/notes for this book in the database.")
 
-        for content, item_type, original_id in items_for_book:
-            # Removed duplicate checking logic based on original_id as per user request
-            # All notes/highlights from the DB will be added.
-            
-            success = add_note_to_item(zot, book_item_key, content, item_type, original_id)
-            if success:
+        # Submit notes in chunks of up to ZOTERO_BATCH_SIZE per create_items call
+        for i in range(0, len(note_templates), ZOTERO_BATCH_SIZE):
+            chunk = note_templates[i:i + ZOTERO_BATCH_SIZE]
+            chunk_refs = note_refs[i:i + ZOTERO_BATCH_SIZE]
+            created_indices = add_notes_to_item(zot, chunk, chunk_refs)
+            for index in created_indices:
+                item_type, original_id = chunk_refs[index]
                 print(f"    Successfully added {item_type} (ID: {original_id}) to Zotero for '{book_title}'.")
                 processed_notes += 1
 
@@ -106,61 +136,57 @@ def get_or_create_collection(zot_client, collection_name):
         print(f"Error creating collection '{collection_name}': {e}")
         return None
 
-def get_or_create_book_item(zot_client, collection_id, title, author, asin):
+def index_collection_books(zot_client, collection_id):
     """
-    Gets a Zotero book item by title within a specific collection, 
-    or creates it if it doesn't exist. Adds ASIN to the 'extra' field for better identification.
+    Fetches every book item in the collection once and indexes it by (title, ASIN) for
+    get_or_create_book_item, so each book lookup is a dict access instead of a Zotero API call.
     """
-    # Search for the book by title. Zotero search can be broad.
-    # We will refine by checking collection and ASIN.
-    # Note: Zotero's basic search ('q') searches all fields.
-    # We'll try to find by title and then verify ASIN from extra field
-    
-    # existing_items = zot_client.everything(zot_client.items(q=title, itemType='book', collectionID=collection_id))
-    # The above line might be too broad or inefficient.
-    # Let's get items in the collection and then filter.
-    collection_items = zot_client.collection_items(collection_id, itemType='book')
-    
-    # The zot_client.collection_items might return a list of full item dicts or summaries.
-    # We need to ensure we are working with full item data for the 'extra' field.
-    # However, for an initial check, the summary data might be sufficient if 'extra' is included.
-    # If not, a zot_client.item(item_key) call would be needed for each.
-    # For performance, let's assume 'extra' is often in the summary data from collection_items.
-
-    for item_summary in collection_items:
-        # Ensure item_summary is a dict and has 'data'
-        if not isinstance(item_summary, dict) or 'data' not in item_summary:
+    book_index = {}
+    book_count = 0
+    for item in zot_client.everything(zot_client.collection_items(collection_id, itemType='book')):
+        # Ensure item is a dict and has 'data'
+        if not isinstance(item, dict) or 'data' not in item:
             continue
+        add_book_to_index(book_index, item)
+        book_count += 1
+    print(f"Indexed {book_count} existing book items in the Zotero collection.")
+    return book_index
 
-        item_data = item_summary.get('data', {})
-        item_title = item_data.get('title', '')
-        item_extra = item_data.get('extra', '') # 'extra' might not always be in summary
-        item_key = item_summary.get('key')
-
-        # If 'extra' is not in the summary, we might need to fetch the full item.
-        # This is a common pattern with the Zotero API.
-        # For now, we proceed if item_extra is None and asin is also None/empty,
-        # or if item_extra is present for comparison.
-        # A more robust check fetches the full item if item_extra is missing and asin is relevant.
-        
-        if item_title == title:
-            # If ASIN is provided, we must match it in the extra field.
-            if asin and asin != "UnknownASIN":
-                if item_extra and f"ASIN: {asin}" in item_extra:
-                    print(f"  Found existing Zotero book item for '{title}' (ASIN: {asin}) with key: {item_key}")
-                    # Fetch the full item to ensure we return consistent data structure
-                    return zot_client.item(item_key) if item_key else item_summary
-                # If ASIN is provided but not found in extra, this is not a match.
-                # However, if item_extra was not available in summary, we *could* fetch full item here to check.
-                # For simplicity, we'll assume if ASIN is critical, 'extra' should be checked.
-            else: # No ASIN provided or it's an "UnknownASIN", so title match is enough
-                print(f"  Found existing Zotero book item for '{title}' (No specific ASIN match required) with key: {item_key}")
-                return zot_client.item(item_key) if item_key else item_summary
+def add_book_to_index(book_index, item):
+    """
+    Adds a Zotero book item to the index under (title, ASIN) for each ASIN in its 'extra' field,
+    and under (title, None) for lookups where no ASIN is known. Earlier items take precedence.
+    """
+    item_data = item['data']
+    item_title = item_data.get('title', '')
+    for match in EXTRA_ASIN_RE.finditer(item_data.get('extra', '')):
+        book_index.setdefault((item_title, match.group(1)), item)
+    book_index.setdefault((item_title, None), item)
 
+def get_or_create_book_item(zot_client, collection_id, book_index, book_template, title, author, asin):
+    """
+    Gets a Zotero book item by title within a specific collection, 
+    or creates it if it doesn't exist. Adds ASIN to the 'extra' field for better identification.
+    book_index is the index built by index_collection_books; newly created items are added to it.
+    book_template is the 'book' item template fetched once by main(); it is copied, not modified.
+    Returns an item dict with at least 'key' and 'data', or None if the item could not be created.
+    """
+    # If ASIN is provided, we must match it in the extra field.
+    # No ASIN provided or it's an "UnknownASIN", so title match is enough
+    if asin and asin != "UnknownASIN":
+        existing_item = book_index.get((title, asin))
+        if existing_item:
+            print(f"  Found existing Zotero book item for '{title}' (ASIN: {asin}) with key: {existing_item['key']}")
+            return existing_item
+    else:
+        existing_item = book_index.get((title, None))
+        if existing_item:
+            print(f"  Found existing Zotero book item for '{title}' (No specific ASIN match required) with key: {existing_item['key']}")
+            return existing_item
 
     # If not found, create it
     print(f"  Book item '{title}' (ASIN: {asin}) not found in Zotero collection. Creating new item...")
-    template = zot_client.item_template('book')
+    template = copy.deepcopy(book_template)
     template['title'] = title
     
     # Revised author handling
@@ -220,9 +246,11 @@ def get_or_create_book_item(zot_client, collection_id, title, author, asin):
             # and values are dicts containing the 'key' and 'version' of the created item.
             created_item_info = list(resp['successful'].values())[0] 
             new_item_key = created_item_info['key']
-            # Fetch the full item data as create_items only returns a summary
-            new_item_data = zot_client.item(new_item_key)
-            print(f"  Successfully created Zotero book item for '{title}' with key: {new_item_data['key']}")
+            # Callers only need the key, so build the item from the submitted template
+            # instead of fetching the full item back from the API
+            new_item_data = {'key': new_item_key, 'data': template}
+            add_book_to_index(book_index, new_item_data)
+            print(f"  Successfully created Zotero book item for '{title}' with key: {new_item_key}")
             return new_item_data
         else:
             print(f"  Failed to create Zotero item for '{title}'. Response: {resp}")
@@ -235,29 +263,38 @@ def get_or_create_book_item(zot_client, collection_id, title, author, asin):
         print(f"  Error creating Zotero item for '{title}': {e}")
         return None
 
-def add_note_to_item(zot_client, parent_item_key, note_content, item_type, original_db_id):
-    """Creates a Zotero note and attaches it to the parent item."""
-    template = zot_client.item_template('note')
+def build_note_template(note_template, parent_item_key, note_content, item_type):
+    """Builds a Zotero note attached to the parent item from a copy of the 'note' template, without submitting it."""
+    template = copy.deepcopy(note_template)
     # Zotero notes are HTML. Basic formatting for readability.
-    html_note_content = f"<p><em>Kindle {item_type.capitalize()}</em></p><p>{note_content.replace('\n', '<br>')}</p>"
+    note_html_body = note_content.replace('\n', '<br>')
+    html_note_content = f"<p><em>Kindle {item_type.capitalize()}</em></p><p>{note_html_body}</p>"
     # Removed appending original_id to the note content itself
     template['note'] = html_note_content
     template['parentItem'] = parent_item_key
     template['tags'] = [{'tag': 'Kindle Import'}]
-    
+    return template
+
+def add_notes_to_item(zot_client, note_templates, note_refs):
+    """
+    Creates a batch of Zotero notes (at most ZOTERO_BATCH_SIZE) in a single request.
+    note_refs holds an (item_type, original_db_id) pair for each template, used for logging.
+    Returns the indices (into note_templates) of the notes that were created.
+    """
     try:
-        resp = zot_client.create_items([template])
-        if resp['successful']:
-            return True
-        else:
-            print(f"    Failed to create note. Response: {resp}")
-            if resp.get('failed'):
-                for k, v in resp['failed'].items():
-                    print(f"      Failure reason for note (original_id: {original_db_id}): {v.get('message', 'No message')}, Code: {v.get('code', 'N/A')}")
-            return False
+        resp = zot_client.create_items(note_templates)
     except Exception as e:
-        print(f"    Error creating Zotero note (original_id: {original_db_id}): {e}")
-        return False
+        original_ids = ", ".join(str(original_db_id) for _, original_db_id in note_refs)
+        print(f"    Error creating Zotero notes (original_ids: {original_ids}): {e}")
+        return []
+
+    if not resp['successful']:
+        print(f"    Failed to create notes. Response: {resp}")
+    # The response dicts are keyed by the string index of each template in the submitted batch
+    for k, v in resp.get('failed', {}).items():
+        _, original_db_id = note_refs[int(k)]
+        print(f"      Failure reason for note (original_id: {original_db_id}): {v.get('message', 'No message')}, Code: {v.get('code', 'N/A')}")
+    return sorted(int(k) for k in resp['successful'])
 
 if __name__ == "__main__":
     main()
@@ -1,15 +1,16 @@
+import argparse
 import asyncio
 import sqlite3
 from playwright.async_api import async_playwright, TimeoutError as PlaywrightTimeoutError
 import time
 import re # For extracting ASINs if needed
-import random # Added for random delay
 import os # For checking file existence
 import json # For parsing auth_state.json
 
 # Constants
 TEST_MODE = False  # Set to True to only process the first book, False to process all books
 KINDLE_NOTEBOOK_URL = "https://read.amazon.com/notebook"
+BOOK_CONCURRENCY = 4 # Number of books scraped in parallel, each in its own browser context
 # Placeholder selectors - REPLACE THESE WITH YOUR FINDINGS from rendered_html.md or manual inspection
 BOOK_LIST_SELECTOR = "div.kp-notebook-library-each-book" # Example, adjust
 BOOK_TITLE_IN_LIST_SELECTOR = "h2.kp-notebook-searchable" # Example, adjust
@@ -22,8 +23,53 @@ HIGHLIGHT_TEXT_SELECTOR = "#highlight" # within highlight div
 NOTE_TEXT_SELECTOR = "#note" # within note div
 EXPORT_LIMIT_NOTICE_SELECTOR = "div.a-alert-content:has-text('Some highlights have been hidden or truncated due to export limits.')"
 
+# In-page extraction scripts, run with locator.evaluate_all over the matched book/highlight/note divs.
+# Missing title/author elements come back as null.
+BOOK_LIST_JS = """
+(books, [titleSelector, authorSelector, idAttribute]) => books.map(b => ({
+    title: b.querySelector(titleSelector)?.textContent ?? null,
+    author: b.querySelector(authorSelector)?.textContent ?? null,
+    raw_id: b.getAttribute(idAttribute),
+}))
+"""
+# Highlights and notes are returned together in document order, each tagged with its kind.
+# A highlight's associated note is the first note div among its following siblings, before the next
+# highlight; it is reported as note_index, the position of that note in the returned array.
+EXTRACT_ANNOTATIONS_JS = """
+(annotations, [highlightSelector, noteSelector, highlightTextSelector, noteTextSelector]) => {
+    const positions = new Map(annotations.map((a, i) => [a, i]));
+    return annotations.map(a => {
+        if (a.matches(noteSelector)) {
+            return {kind: "note", id: a.id, text: a.querySelector(noteTextSelector)?.textContent ?? "", note_index: null};
+        }
+        let n = a.nextElementSibling;
+        while (n && !n.matches(noteSelector) && !n.matches(highlightSelector)) n = n.nextElementSibling;
+        const noteIndex = n && n.matches(noteSelector) ? positions.get(n) ?? null : null;
+        return {kind: "highlight", id: a.id, text: a.querySelector(highlightTextSelector)?.textContent ?? "", note_index: noteIndex};
+    });
+}
+"""
+
 DB_NAME = "kindle_highlights.sqlite"
 TABLE_NAME = "highlights_notes"
+# Applied to every connection: WAL journaling with relaxed fsyncs, in-memory temp storage,
+# a ~20 MB page cache and a 256 MB mmap window
+SQLITE_PRAGMAS = """
+PRAGMA journal_mode=WAL;
+PRAGMA synchronous=NORMAL;
+PRAGMA temp_store=MEMORY;
+PRAGMA cache_size=-20000;
+PRAGMA mmap_size=268435456;
+"""
+# U+201C/U+201D = left/right double curly quotes -> single straight quote,
+# U+2018 = left single curly quote -> double straight quote (always a quotation mark)
+CURLY_QUOTES = "\u2018\u2019\u201c\u201d" # Every character convert_quotes rewrites
+QUOTE_TRANSLATION = str.maketrans({"\u201c": "'", "\u201d": "'", "\u2018": '"'})
+RIGHT_SINGLE_QUOTE_RE = re.compile("\u2019") # U+2019 = right single curly quote (apostrophe or quote mark)
+ASIN_RE = re.compile(r"[A-Z0-9]{10}") # 10-char alphanumeric string inside a book entry's id
+COLUMNS = ("book_title", "book_author", "book_asin", "item_type", "content", "original_id") # Column order of collected rows
+# Built once for the fixed schema; INSERT OR IGNORE for robustness with the UNIQUE original_id constraint
+INSERT_SQL = f"""INSERT OR IGNORE INTO "{TABLE_NAME}" ({', '.join(f'"{col}"' for col in COLUMNS)}) VALUES ({', '.join('?' * len(COLUMNS))})"""
 
 def convert_quotes(text):
     """
@@ -37,45 +83,33 @@ def convert_quotes(text):
     
     Uses context-based heuristics for differentiating apostrophes from quotation marks.
     """
-    # First, handle double curly quotes - using explicit Unicode escape sequences
-    # U+201C = left double curly quote, U+201D = right double curly quote
-    text = text.replace("\u201c", "'").replace("\u201d", "'")
-    
-    # Create a function to determine if a character is alphanumeric
-    def is_alphanum(char):
-        return char.isalnum() if char else False
-
-    # Process single curly quotes with context awareness
-    # U+2018 = left single curly quote, U+2019 = right single curly quote
-    result = []
-    i = 0
-    while i < len(text):
-        # Check for left single curly quote - always a quotation mark
-        if i < len(text) and text[i] == "\u2018":
-            result.append('"')  # Convert to double straight quote
-        
-        # Check for right single curly quote - could be apostrophe or quote
-        elif i < len(text) and text[i] == "\u2019":
-            # Get context (character before and after)
-            prev_char = text[i-1] if i > 0 else ' '
-            next_char = text[i+1] if i+1 < len(text) else ' '
-            
-            # Definite apostrophe cases:
-            # 1. Inside a word (like don't, can't) - when both sides are letters
-            # 2. After 's' at the end of a word - plural possessive
-            if (prev_char.isalpha() and next_char.isalpha()) or \
-               (prev_char.lower() == "s" and not is_alphanum(next_char)):
-                result.append("'")  # Keep as straight single quote for apostrophes
-            # Likely quote mark cases:
-            # 1. Quote preceded by a letter and followed by space/punctuation (closing quote)
-            # 2. Quote surrounded by spaces/punctuation (isolated quote)
-            else:
-                result.append('"')  # Convert to double straight quote for quotations
-        else:
-            result.append(text[i])
-        i += 1
+    # Most highlights contain no curly quotes at all; substring checks skip them cheaply
+    if not any(quote in text for quote in CURLY_QUOTES):
+        return text
+    # Double curly quotes and the left single curly quote map directly to straight quotes,
+    # so translate them in one C-level pass
+    text = text.translate(QUOTE_TRANSLATION)
+    # Right single curly quotes need context, so only those are visited by the regex
+    return RIGHT_SINGLE_QUOTE_RE.sub(replace_right_single_quote, text)
+
+def replace_right_single_quote(match):
+    """Returns the straight replacement for a right single curly quote matched by RIGHT_SINGLE_QUOTE_RE."""
+    text = match.string
+    i = match.start()
+    # Get context (character before and after)
+    prev_char = text[i-1] if i > 0 else ' '
+    next_char = text[i+1] if i+1 < len(text) else ' '
     
-    return "".join(result)
+    # Definite apostrophe cases:
+    # 1. Inside a word (like don't, can't) - when both sides are letters
+    # 2. After 's' at the end of a word - plural possessive
+    if (prev_char.isalpha() and next_char.isalpha()) or \
+       (prev_char.lower() == "s" and not next_char.isalnum()):
+        return "'"  # Keep as straight single quote for apostrophes
+    # Likely quote mark cases:
+    # 1. Quote preceded by a letter and followed by space/punctuation (closing quote)
+    # 2. Quote surrounded by spaces/punctuation (isolated quote)
+    return '"'  # Convert to double straight quote for quotations
 
 async def save_auth_state(page, path="auth_state.json"):
     await page.context.storage_state(path=path)
@@ -93,9 +127,25 @@ async def initial_login_and_save_state():
         await save_auth_state(page)
         await browser.close()
 
+def asin_from_book_id(raw_book_id):
+    """Extracts the ASIN from a book entry's id attribute, falling back to a custom id or "UnknownASIN"."""
+    # Try to extract ASIN from common patterns in id or data-asin
+    if not raw_book_id:
+        return "UnknownASIN"
+    match = ASIN_RE.search(raw_book_id)
+    if match:
+        return match.group(0)
+    return f"custom_id_{raw_book_id}" # Fallback
+
+def notebook_url_for(asin):
+    """Returns the Kindle Notebook URL that opens directly on the book with the given ASIN."""
+    return f"{KINDLE_NOTEBOOK_URL}?asin={asin}&contentLimitState=&"
+
 def setup_database():
+    """Opens the database with SQLITE_PRAGMAS applied, ensures the table exists and returns the open connection."""
     conn = sqlite3.connect(DB_NAME)
     cursor = conn.cursor()
+    cursor.executescript(SQLITE_PRAGMAS)
     cursor.execute(f"""
     CREATE TABLE IF NOT EXISTS {TABLE_NAME} (
         id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -110,9 +160,34 @@ def setup_database():
         retrieved_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
     )
     """)
+    # Lets get_scraped_asins() read the distinct ASINs from the index alone
+    cursor.execute(f"CREATE INDEX IF NOT EXISTS idx_book_asin ON {TABLE_NAME}(book_asin)")
+    # Lets pyzotero-etl.py read rows grouped by book in index order, without a sort step
+    cursor.execute(f"CREATE INDEX IF NOT EXISTS idx_book ON {TABLE_NAME}(book_title, book_author, book_asin)")
+    # Serves the "most recent" previews in query_db.py from an index range
+    cursor.execute(f"CREATE INDEX IF NOT EXISTS idx_item_type_retrieved ON {TABLE_NAME}(item_type, retrieved_at DESC)")
     conn.commit()
-    conn.close()
     print(f"Database '{DB_NAME}' and table '{TABLE_NAME}' ensured.")
+    return conn
+
+def get_scraped_asins(conn):
+    """Returns the set of book ASINs that already have highlights or notes in the database."""
+    return {row[0] for row in conn.execute(f"SELECT DISTINCT book_asin FROM {TABLE_NAME}")}
+
+def save_book_rows(conn, book_title, book_rows):
+    """Inserts one book's rows (tuples in COLUMNS order) in a single transaction."""
+    try:
+        # One transaction per book: a single commit for all of its rows
+        conn.execute("BEGIN IMMEDIATE")
+        conn.executemany(INSERT_SQL, book_rows)
+        conn.commit()
+        print(f"Saved {len(book_rows)} items for {book_title} to SQLite database: {DB_NAME}")
+    except sqlite3.IntegrityError as e:
+        conn.rollback()
+        print(f"SQLite Integrity Error (likely duplicate original_id) for {book_title}: {e}. Its rows might not have been inserted.")
+    except Exception as e:
+        conn.rollback()
+        print(f"Error saving {book_title} to SQLite: {e}")
 
 def is_auth_state_valid(auth_file_path: str) -> bool:
     if not os.path.exists(auth_file_path):
@@ -130,11 +205,15 @@ def is_auth_state_valid(auth_file_path: str) -> bool:
              return False
 
         current_time = time.time()
-        for cookie in cookies:
-            if 'expires' in cookie and isinstance(cookie['expires'], (int, float)):
-                if cookie['expires'] < current_time:
-                    print(f"Authentication state has expired cookie: {cookie.get('name', 'Unnamed cookie')}")
-                    return False
+        # Find the first cookie with a numeric 'expires' in the past, stopping at the first hit
+        expired_cookie = next(
+            (cookie for cookie in cookies
+             if isinstance(cookie.get('expires'), (int, float)) and cookie['expires'] < current_time),
+            None
+        )
+        if expired_cookie is not None:
+            print(f"Authentication state has expired cookie: {expired_cookie.get('name', 'Unnamed cookie')}")
+            return False
         return True # All cookies with 'expires' are valid
     except FileNotFoundError:
         return False # Should be caught by os.path.exists, but as a safeguard
@@ -145,81 +224,64 @@ def is_auth_state_valid(auth_file_path: str) -> bool:
         print(f"An unexpected error occurred while checking auth state {auth_file_path}: {e}")
         return False
 
-async def scrape_kindle_highlights():
-    setup_database()
-    limited_export_books = []
-    all_collected_data = [] # To store data before batch writing to DB
-    processed_note_ids = set() # Track which notes have been processed with highlights
+async def resolve_book_author(page, book_author):
+    """Returns book_author, or the author shown in the book's detail view if the list view didn't give one."""
+    if book_author and book_author != "Unknown Author":
+        return book_author
+    # The detail view renders with the highlights, so a missing author shows up as a short timeout
+    # rather than being checked for with a separate count() round-trip
+    try:
+        detail_author = await page.locator(BOOK_AUTHOR_IN_DETAIL_SELECTOR).first.text_content(timeout=500)
+    except PlaywrightTimeoutError:
+        return book_author
+    book_author = (detail_author or "").strip()
+    print(f"Updated author from detail view: {book_author}")
+    return book_author
 
-    async with async_playwright() as p:
-        browser = await p.chromium.launch(headless=True) # Can be headless now
-        try:
-            context = await browser.new_context(storage_state="auth_state.json")
-        except FileNotFoundError:
-            print("Error: auth_state.json not found. Run initial_login_and_save_state() first.")
-            return
+async def process_book(browser, book, list_index, index, total, semaphore):
+    """
+    Scrapes one book's highlights and notes in its own browser context, reusing the saved
+    login state, while holding the semaphore that bounds how many books run at once
+    (which is also what keeps the request rate polite, in place of fixed delays).
+    list_index is the book's position in the full book list on the page, used to click books
+    without an id; index and total only number the progress output.
+    Returns (book_title, book_rows, has_export_limit), with rows as tuples in COLUMNS order.
+    """
+    book_title = "Unknown Title"
+    book_author = "Unknown Author"
+    book_asin = "UnknownASIN"
+    book_rows = []
+    has_export_limit = False
+    processed_note_positions = set() # Track which notes (by position in annotation_records) have been processed with highlights
 
-        page = await context.new_page()
-        await page.goto(KINDLE_NOTEBOOK_URL, timeout=90000, wait_until="networkidle")
-        print("Navigated to Kindle Notebook.")
-        await page.wait_for_timeout(5000) # Give it a moment to settle
+    if book["title"] is not None:
+        book_title = book["title"].strip()
+    
+    if book["author"] is not None:
+        author_text = book["author"].strip()
+        # Clean up the author text by removing "By: " prefix if present
+        book_author = author_text.replace("By:", "").strip() if "By:" in author_text else author_text
+    
+    book_asin = asin_from_book_id(book["raw_id"])
 
-        # --- Get List of Books ---
+    async with semaphore:
+        # Opening or closing the book's context can fail as well; like any other per-book error this is
+        # logged and the book comes back without rows, rather than failing its task and the whole run
+        context = None
         try:
-            await page.wait_for_selector(BOOK_LIST_SELECTOR, timeout=30000)
-        except PlaywrightTimeoutError:
-            print(f"Timeout waiting for book list with selector: {BOOK_LIST_SELECTOR}")
-            print("Page content:", await page.content()) # For debugging
-            await browser.close()
-            return
-
-        book_elements = await page.locator(BOOK_LIST_SELECTOR).all()
-        print(f"Found {len(book_elements)} potential book entries.")
-        if not book_elements:
-            print("No books found. Check BOOK_LIST_SELECTOR or rendered_html.md")
-            await browser.close()
-            return
-
-        # Iterate through each book
-        for i in range(len(book_elements)):
-            current_book_elements = await page.locator(BOOK_LIST_SELECTOR).all()
-            if i >= len(current_book_elements):
-                print(f"Index {i} out of bounds for current book elements. Stopping.")
-                break
-            
-            book_element = current_book_elements[i]
-            
-            book_title = "Unknown Title"
-            book_author = "Unknown Author"
-            book_asin = "UnknownASIN"
-
+            context = await browser.new_context(storage_state="auth_state.json")
+            page = await context.new_page()
             try:
-                title_locator = book_element.locator(BOOK_TITLE_IN_LIST_SELECTOR)
-                if await title_locator.count() > 0:
-                    book_title = (await title_locator.first.text_content() or "").strip()
-                else:
-                    book_title = "Unknown Title" # Default if not found
-                
-                author_locator = book_element.locator(BOOK_AUTHOR_IN_LIST_SELECTOR)
-                if await author_locator.count() > 0:
-                    author_text = (await author_locator.first.text_content() or "").strip()
-                    # Clean up the author text by removing "By: " prefix if present
-                    book_author = author_text.replace("By:", "").strip() if "By:" in author_text else author_text
-                else:
-                    book_author = "Unknown Author" # Default if not found
-                
-                raw_book_id = await book_element.get_attribute(BOOK_ASIN_ATTRIBUTE)
-                # Try to extract ASIN from common patterns in id or data-asin
-                if raw_book_id:
-                    match = re.search(r"([A-Z0-9]{10})", raw_book_id) # Look for 10-char alphanumeric string
-                    if match:
-                        book_asin = match.group(1)
-                    else:
-                        book_asin = f"custom_id_{raw_book_id}" # Fallback
-                
-                print(f"\nProcessing book ({i+1}/{len(book_elements)}): {book_title} (Author: {book_author}) (ASIN/ID: {book_asin})")
+                print(f"\nProcessing book ({index+1}/{total}): {book_title} (Author: {book_author}) (ASIN/ID: {book_asin})")
 
-                await book_element.click()
+                # Open the book's notebook view directly by its ASIN. Books whose id held no ASIN
+                # (the custom_id_ and UnknownASIN fallbacks) are clicked in the list instead, since an
+                # unknown asin= opens the notebook's default book rather than failing.
+                if ASIN_RE.fullmatch(book_asin):
+                    await page.goto(notebook_url_for(book_asin), timeout=90000, wait_until="networkidle")
+                else:
+                    await page.goto(KINDLE_NOTEBOOK_URL, timeout=90000, wait_until="networkidle")
+                    await page.locator(BOOK_LIST_SELECTOR).nth(list_index).click()
                 
                 try:
                     # Wait for highlights/notes to load. This selector might need adjustment.
@@ -227,39 +289,46 @@ async def scrape_kindle_highlights():
                     # Let's use a more general approach: wait for any highlight or note to appear.
                     await page.wait_for_selector(f'{HIGHLIGHT_SELECTOR}, {NOTE_SELECTOR}', timeout=20000)
                     print("Highlights/notes section loaded.")
-                    
-                    # Try to get author from detail view if we don't have good author info yet
-                    if book_author == "Unknown Author" or not book_author:
-                        # Wait a bit for the detail view to fully load
-                        await page.wait_for_timeout(1000)
-                        # Try to find author in the detail view
-                        detail_author_locator = page.locator(BOOK_AUTHOR_IN_DETAIL_SELECTOR)
-                        if await detail_author_locator.count() > 0:
-                            book_author = (await detail_author_locator.first.text_content() or "").strip()
-                            print(f"Updated author from detail view: {book_author}")
                 except PlaywrightTimeoutError:
                     print(f"Timeout waiting for highlights/notes to load for {book_title}. Skipping this book's highlights.")
-                    # If book list isn't stable, might need to page.go_back() and re-wait for BOOK_LIST_SELECTOR
-                    continue
-                
-                await page.wait_for_timeout(2000) # Extra buffer
+                    return book_title, book_rows, has_export_limit
 
-                if await page.is_visible(EXPORT_LIMIT_NOTICE_SELECTOR):
+                # The detail author, export limit notice and annotations are independent reads of the
+                # loaded page, so they are awaited together instead of one round-trip after another.
+                # Every highlight and note comes back from one in-page evaluate call, in document order.
+                # All three are let finish before the first error is re-raised, so none is still
+                # running against the page when the context is closed below.
+                page_reads = await asyncio.gather(
+                    resolve_book_author(page, book_author),
+                    page.is_visible(EXPORT_LIMIT_NOTICE_SELECTOR),
+                    page.locator(f"{HIGHLIGHT_SELECTOR}, {NOTE_SELECTOR}").evaluate_all(
+                        EXTRACT_ANNOTATIONS_JS,
+                        [HIGHLIGHT_SELECTOR, NOTE_SELECTOR, HIGHLIGHT_TEXT_SELECTOR, NOTE_TEXT_SELECTOR]
+                    ),
+                    return_exceptions=True,
+                )
+                for page_read in page_reads:
+                    if isinstance(page_read, BaseException):
+                        raise page_read
+                book_author, has_export_limit, annotation_records = page_reads
+                if has_export_limit:
                     print(f"WARNING: Export limit notice found for '{book_title}'.")
-                    if book_title not in limited_export_books:
-                        limited_export_books.append(book_title)
-                
+                # Map each highlight to its associated note record in one pass
+                note_by_highlight = {
+                    position: annotation_records[record["note_index"]]
+                    for position, record in enumerate(annotation_records)
+                    if record["kind"] == "highlight" and record["note_index"] is not None
+                }
+
                 # Process highlights first, checking for associated notes
-                highlight_divs = await page.locator(HIGHLIGHT_SELECTOR).all()
                 highlight_count = 0
                 highlight_with_note_count = 0
                 
-                for hl_div in highlight_divs:
-                    original_id = await hl_div.get_attribute("id")
-                    text_locator = hl_div.locator(HIGHLIGHT_TEXT_SELECTOR)
-                    text_content = ""
-                    if await text_locator.count() > 0:
-                        text_content = (await text_locator.first.text_content() or "").strip()
+                for position, record in enumerate(annotation_records):
+                    if record["kind"] != "highlight":
+                        continue
+                    original_id = record["id"]
+                    text_content = record["text"].strip()
                     
                     if text_content and original_id:
                         # Convert curly quotes and then quote the highlight
@@ -267,64 +336,36 @@ async def scrape_kindle_highlights():
                         quoted_highlight = f'"{text_content}"'
                         final_content = quoted_highlight
                         
-                        # Check for associated note that appears near this highlight
-                        associated_note_locator = page.locator(f'{NOTE_SELECTOR}:near(#{original_id})')
-                        has_associated_note = await associated_note_locator.count() > 0
+                        # Append the associated note, if it has text
+                        associated_note = note_by_highlight.get(position)
+                        note_text = associated_note["text"].strip() if associated_note else ""
+                        if note_text:
+                            # Also convert curly quotes in the note text
+                            note_text = convert_quotes(note_text)
+                            # Append note to the quoted highlight with a space
+                            final_content = f"{quoted_highlight} {note_text}"
+                            processed_note_positions.add(record["note_index"])
+                            highlight_with_note_count += 1
                         
-                        if has_associated_note:
-                            associated_note = associated_note_locator.first
-                            note_id = await associated_note.get_attribute("id")
-                            note_text_locator = associated_note.locator(NOTE_TEXT_SELECTOR)
-                            
-                            if await note_text_locator.count() > 0:
-                                note_text = (await note_text_locator.first.text_content() or "").strip()
-                                if note_text:
-                                    # Also convert curly quotes in the note text
-                                    note_text = convert_quotes(note_text)
-                                    # Append note to the quoted highlight with a space
-                                    final_content = f"{quoted_highlight} {note_text}"
-                                    processed_note_ids.add(note_id)
-                                    highlight_with_note_count += 1
-                        
-                        all_collected_data.append({
-                            "book_title": book_title,
-                            "book_author": book_author,
-                            "book_asin": book_asin,
-                            "item_type": "highlight",
-                            "content": final_content,
-                            "original_id": original_id
-                        })
+                        book_rows.append((book_title, book_author, book_asin, "highlight", final_content, original_id))
                         highlight_count += 1
                 
                 print(f"Found {highlight_count} highlights for {book_title}, of which {highlight_with_note_count} have associated notes.")
 
                 # Process orphaned notes (notes without highlights)
-                note_divs = await page.locator(NOTE_SELECTOR).all()
                 orphan_note_count = 0
                 
-                for nt_div in note_divs:
-                    original_id = await nt_div.get_attribute("id")
-                    
-                    # Skip notes that were already processed with highlights
-                    if original_id in processed_note_ids:
+                for position, record in enumerate(annotation_records):
+                    # Skip highlights, and notes that were already processed with highlights
+                    if record["kind"] != "note" or position in processed_note_positions:
                         continue
-                    
-                    text_locator = nt_div.locator(NOTE_TEXT_SELECTOR)
-                    text_content = ""
-                    if await text_locator.count() > 0:
-                        text_content = (await text_locator.first.text_content() or "").strip()
+                    original_id = record["id"]
+                    text_content = record["text"].strip()
                     
                     if text_content and original_id:
                         # Convert curly quotes in orphaned notes
                         text_content = convert_quotes(text_content)
-                        all_collected_data.append({
-                            "book_title": book_title,
-                            "book_author": book_author,
-                            "book_asin": book_asin,
-                            "item_type": "note",
-                            "content": text_content,
-                            "original_id": original_id
-                        })
+                        book_rows.append((book_title, book_author, book_asin, "note", text_content, original_id))
                         orphan_note_count += 1
                 
                 print(f"Found {orphan_note_count} orphaned notes for {book_title}.")
@@ -333,38 +374,121 @@ async def scrape_kindle_highlights():
                 print(f"Timeout error processing book {book_title}: {e}")
             except Exception as e:
                 print(f"An error occurred processing book {book_title}: {e}")
-            
-            await page.wait_for_timeout(1000 + random.randint(0,1000)) # Random delay
-            
-            # If in test mode, break after processing the first book
-            if TEST_MODE and i == 0:
-                print("TEST MODE: Only processing the first book. Set TEST_MODE = False to process all books.")
-                break
-
-    if all_collected_data:
-        conn = sqlite3.connect(DB_NAME)
-        try:
-            # Using INSERT OR IGNORE for robustness with UNIQUE constraint
-            cursor = conn.cursor()
-            for row in all_collected_data:
-                cols = ', '.join([f'"{col}"' for col in row.keys()]) # Quote column names
-                placeholders = ', '.join('?' * len(row))
-                sql = f"INSERT OR IGNORE INTO \"{TABLE_NAME}\" ({cols}) VALUES ({placeholders})"
-                try:
-                    cursor.execute(sql, list(row.values()))
-                except sqlite3.InterfaceError as ie:
-                    print(f"SQLite InterfaceError for row {row}: {ie}. SQL: {sql}") # Debug specific row error
-            conn.commit()
-            print(f"\nSuccessfully saved/updated {len(all_collected_data)} items to SQLite database: {DB_NAME}")
-        except sqlite3.IntegrityError as e:
-             print(f"SQLite Integrity Error (likely duplicate original_id): {e}. Some rows might not have been inserted.")
         except Exception as e:
-            print(f"Error saving to SQLite: {e}")
+            print(f"Could not open a browser context for book {book_title}: {e}")
         finally:
-            conn.close()
+            if context is not None:
+                try:
+                    await context.close()
+                except Exception as e:
+                    print(f"Error closing the browser context for book {book_title}: {e}")
+
+    return book_title, book_rows, has_export_limit
+
+async def queue_book(queue, *process_book_args):
+    """
+    Runs process_book() with the given arguments and puts its result on the writer's queue.
+    The coroutine is only created once the task starts, so tasks cancelled before they run
+    leave no un-awaited process_book() coroutine behind.
+    """
+    await queue.put(await process_book(*process_book_args))
+
+async def db_writer(conn, queue, limited_export_books):
+    """
+    Saves each (book_title, book_rows, has_export_limit) taken from queue until it receives None,
+    noting books with export limits in limited_export_books. Returns the number of rows saved.
+    """
+    collected_count = 0
+    while (finished_book := await queue.get()) is not None:
+        book_title, book_rows, has_export_limit = finished_book
+        if book_rows:
+            save_book_rows(conn, book_title, book_rows)
+            collected_count += len(book_rows)
+        if has_export_limit and book_title not in limited_export_books:
+            limited_export_books.append(book_title)
+    return collected_count
+
+async def scrape_kindle_highlights(conn, refresh=False):
+    """
+    Scrapes every book in the Kindle Notebook into the database open on conn. Books whose ASIN already
+    has rows in the database are skipped unless refresh is True, so reruns only fetch newly added books.
+    """
+    scraped_asins = set() if refresh else get_scraped_asins(conn)
+    limited_export_books = []
+    collected_count = 0
+
+    async with async_playwright() as p:
+        browser = await p.chromium.launch(headless=True) # Can be headless now
+        try:
+            context = await browser.new_context(storage_state="auth_state.json")
+        except FileNotFoundError:
+            print("Error: auth_state.json not found. Run initial_login_and_save_state() first.")
+            return
+
+        page = await context.new_page()
+        await page.goto(KINDLE_NOTEBOOK_URL, timeout=90000, wait_until="networkidle")
+        print("Navigated to Kindle Notebook.")
+
+        # --- Get List of Books ---
+        try:
+            await page.wait_for_selector(BOOK_LIST_SELECTOR, timeout=30000)
+        except PlaywrightTimeoutError:
+            print(f"Timeout waiting for book list with selector: {BOOK_LIST_SELECTOR}")
+            print("Page content:", await page.content()) # For debugging
+            await browser.close()
+            return
+
+        # Read every book's title, author and id in one in-page pass, so the loop below
+        # doesn't re-query the book list for fresh element handles on every iteration
+        books = await page.locator(BOOK_LIST_SELECTOR).evaluate_all(
+            BOOK_LIST_JS,
+            [BOOK_TITLE_IN_LIST_SELECTOR, BOOK_AUTHOR_IN_LIST_SELECTOR, BOOK_ASIN_ATTRIBUTE]
+        )
+        print(f"Found {len(books)} potential book entries.")
+        if not books:
+            print("No books found. Check BOOK_LIST_SELECTOR or rendered_html.md")
+            await browser.close()
+            return
+        # Each book opens its own context below, so the book list page is no longer needed
+        await context.close()
+
+        # Skip books scraped on a previous run. Books without a usable id all share "UnknownASIN",
+        # so they are never treated as already scraped. Each kept book is paired with its position
+        # in the full list, which is what books without an id are clicked by.
+        books_to_scrape = []
+        for list_index, book in enumerate(books):
+            book_asin = asin_from_book_id(book["raw_id"])
+            if book_asin != "UnknownASIN" and book_asin in scraped_asins:
+                print(f"Skipping {(book['title'] or '').strip() or 'Unknown Title'} (ASIN: {book_asin}), already scraped. Use --refresh to scrape it again.")
+            else:
+                books_to_scrape.append((list_index, book))
+        books = books_to_scrape
+        if not books:
+            print("All books have already been scraped. Use --refresh to scrape them again.")
+            await browser.close()
+            return
+
+        # Process the books concurrently, each in its own browser context, at most BOOK_CONCURRENCY at a time
+        if TEST_MODE:
+            print("TEST MODE: Only processing the first book. Set TEST_MODE = False to process all books.")
+            books = books[:1]
+        semaphore = asyncio.Semaphore(BOOK_CONCURRENCY)
+        # Book tasks hand their results to a writer task over a queue, so each book's rows are saved as
+        # soon as it finishes. If a book task fails outright, the task groups cancel the rest, while the
+        # books already written stay in the database.
+        queue = asyncio.Queue()
+        async with asyncio.TaskGroup() as tg:
+            writer = tg.create_task(db_writer(conn, queue, limited_export_books))
+            async with asyncio.TaskGroup() as book_tasks:
+                for i, (list_index, book) in enumerate(books):
+                    book_tasks.create_task(queue_book(queue, browser, book, list_index, i, len(books), semaphore))
+            await queue.put(None) # Every book is queued; tell the writer to stop
+        collected_count = writer.result()
+
+        await browser.close()
 
     print("\n--- Summary ---")
-    print(f"Total items collected: {len(all_collected_data)}")
+    print(f"Total items collected: {collected_count}")
     if limited_export_books:
         print("Books with export limit notices:")
         for book in limited_export_books:
@@ -372,14 +496,20 @@ async def scrape_kindle_highlights():
     else:
         print("No export limit notices encountered.")
 
-    await browser.close()
-
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Scrape Kindle highlights and notes into SQLite.")
+    parser.add_argument("--refresh", action="store_true", help="Re-scrape books that already have highlights in the database")
+    args = parser.parse_args()
     auth_file = "auth_state.json"
     
     if is_auth_state_valid(auth_file):
         print(f"Found valid {auth_file}. Attempting to scrape highlights.")
-        asyncio.run(scrape_kindle_highlights())
+        # One connection, with its PRAGMAs, serves both the setup and the write phase
+        conn = setup_database()
+        try:
+            asyncio.run(scrape_kindle_highlights(conn, refresh=args.refresh))
+        finally:
+            conn.close()
     else:
         if os.path.exists(auth_file):
             print(f"{auth_file} found but is invalid or expired. Attempting to re-authenticate.")